@@ -1,7 +1,17 @@
+import asyncio
+import hashlib
+import io
 import os
+import shutil
+import sys
 import tempfile
-from typing import Union
-from telegram import Update
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import AsyncIterator, BinaryIO, Callable, Iterator, Optional
+import httpx
+from telegram import File, Message, Update
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -9,14 +19,46 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
-from groq import Groq
+from groq import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncGroq,
+    DefaultAsyncHttpxClient,
+    InternalServerError,
+    RateLimitError,
+)
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Groq client
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Initialize Groq client with a pooled keep-alive HTTP client so repeated
+# calls reuse open TLS connections instead of reconnecting each time. The SDK's
+# own retries are disabled in favour of the retry loops around each call, which
+# back off outside groq_semaphore (see retry_delay).
+groq_client = AsyncGroq(
+    api_key=os.getenv("GROQ_API_KEY"),
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_keepalive_connections=20,
+            max_connections=20,
+            keepalive_expiry=30.0,
+        ),
+    ),
+)
+
+# Limits in-flight Groq requests across all users to stay under rate limits
+groq_semaphore = asyncio.Semaphore(16)
+GROQ_ATTEMPTS = 5  # Tries per Groq request before a transient error is raised
+# Groq errors that are worth retrying: rate limits, network problems and
+# server-side failures
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+)
 
 # Telegram bot token
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -24,6 +66,66 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 # Constants
 MAX_FILE_SIZE = 25 * 1024 * 1024  # 25MB in bytes
 MAX_MESSAGE_LENGTH = 4096
+IN_MEMORY_MAX_SIZE = 4 * 1024 * 1024  # Smaller files skip the temp file
+CACHE_SIZE = 1024
+CHUNK_DURATION = 120  # Maximum seconds of audio per chunk for long recordings
+SILENCE_THRESHOLD = "-30dB"  # Quieter audio counts as a pause between words
+SILENCE_MIN_DURATION = 0.5  # Shortest pause in seconds to cut audio at
+TRANSCRIBE_CONCURRENCY = 8  # Maximum chunks transcribed at the same time
+COMPRESS_MIN_SIZE = 512 * 1024  # Smaller files are uploaded as they are
+FFMPEG_TIMEOUT = 300  # Seconds before an ffmpeg or ffprobe run is abandoned
+EDIT_INTERVAL = 1.0  # Minimum seconds between edits of a streamed message
+SUMMARY_SEPARATOR = "### Summary"
+MIN_IMPROVE_WORDS = 30  # Shorter transcriptions are sent as they are
+MIN_SUMMARY_WORDS = 50  # Shorter transcriptions are not summarized
+# Keep temp files on a RAM-backed tmpfs where available (Linux), unless
+# another directory is configured
+TEMP_DIR = os.getenv("TEMP_DIR") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") else None
+)
+# ffmpeg output options for 16kHz mono Opus, the format Whisper works with
+OPUS_ARGS = ["-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "16k"]
+
+# Instructions for the language model. They are sent unchanged as the system
+# message on every request so Groq can reuse the cached prompt prefix; the
+# transcription follows separately as the user message.
+SYSTEM_PROMPT = f"""Task: Improve and summarize the transcription sent by the user
+Instructions for the improved transcription:
+1. Fix any grammatical or spelling errors
+2. Improve readability and coherence
+3. Maintain the original meaning and context
+4. Use appropriate punctuation and formatting
+Instructions for the summary:
+1. Provide a concise summary of the main points
+2. Use bullet points for clarity
+3. Write from the perspective of the transcript
+4. Capture the key ideas and any important details
+5. Ensure the summary is coherent and easy to understand
+
+Respond with the improved transcription, then a line containing only
+"{SUMMARY_SEPARATOR}", then the summary. Do not add any other comments."""
+
+# Used instead of SYSTEM_PROMPT for transcriptions too short to summarize
+IMPROVE_SYSTEM_PROMPT = """Task: Improve the transcription sent by the user
+Instructions:
+1. Fix any grammatical or spelling errors
+2. Improve readability and coherence
+3. Maintain the original meaning and context
+4. Use appropriate punctuation and formatting
+5. Only return the improved text without any additional comments"""
+
+# Whisper results keyed by Telegram's file_unique_id, which stays the same
+# when the same audio is forwarded again
+transcription_cache: "OrderedDict[str, str]" = OrderedDict()
+# Improved transcription and summary keyed by the SHA256 of the original
+# transcription, so long transcriptions aren't kept around as keys
+result_cache: "OrderedDict[str, tuple[str, str]]" = OrderedDict()
+# Transcriptions currently in progress, keyed by file_unique_id
+inflight_transcriptions: dict[str, asyncio.Task] = {}
+# Improvements and summaries currently being generated, keyed like result_cache
+inflight_results: "dict[str, asyncio.Future[tuple[str, str]]]" = {}
+# Keeps fire-and-forget tasks referenced until they finish
+background_tasks: set[asyncio.Task] = set()
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -33,78 +135,562 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
-def split_message(message: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
-    """Split a message into chunks that fit within Telegram's message length limit."""
-    return [message[i : i + max_length] for i in range(0, len(message), max_length)]
+def split_message(message: str, max_length: int = MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    """Split a message into chunks that fit within Telegram's message length limit.
 
+    Chunks end at a paragraph, line or word boundary where possible.
+    """
+    start = 0
+    while len(message) - start > max_length:
+        end = start + max_length
+        for separator in ("\n\n", "\n", " "):
+            boundary = message.rfind(separator, start + 1, end)
+            if boundary != -1:
+                end = boundary + len(separator)
+                break
+        yield message[start:end]
+        start = end
+    if start < len(message):
+        yield message[start:]
+
+
+def cache_put(cache: OrderedDict, key: str, value) -> None:
+    """Store a value, evicting the least recently used entry if the cache is full."""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def cache_get(cache: OrderedDict, key: str):
+    """Return a cached value and mark it as recently used, or None if missing."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+class StreamingReply:
+    """A reply that is sent while its text is still being generated.
+
+    The latest Telegram message is edited in place as text arrives, and a new
+    message is started whenever the text outgrows the message length limit.
+    Intermediate edits are skipped while Telegram's flood control is active;
+    a final flush waits it out so the complete text is always delivered.
+    """
+
+    def __init__(self, update: Update) -> None:
+        self.update = update
+        self.text = ""
+        self.offset = 0  # Start of the text shown in the current message
+        self.message: Optional[Message] = None
+        self.last_edit = 0.0
+        self.retry_at = 0.0  # Flood control blocks edits until this time
+
+    async def set_text(self, text: str) -> None:
+        """Update the reply text, editing the message at most every EDIT_INTERVAL."""
+        self.text = text
+        now = time.monotonic()
+        if now - self.last_edit >= EDIT_INTERVAL and now >= self.retry_at:
+            await self.flush()
+
+    async def flush(self, final: bool = False) -> None:
+        """Bring the sent messages up to date with the current text.
+
+        Unless final is set, the last message is left as it is when Telegram
+        asks to slow down.
+        """
+        parts = list(split_message(self.text[self.offset :]))
+        for part in parts[:-1]:
+            await self._show(part, wait=True)
+            self.message = None
+            self.offset += len(part)
+        if parts:
+            await self._show(parts[-1], wait=final)
+        self.last_edit = time.monotonic()
+
+    async def _show(self, part: str, wait: bool) -> None:
+        part = part.strip()
+        if not part:
+            return
+        while True:
+            try:
+                if self.message is None:
+                    self.message = await self.update.message.reply_text(
+                        part, do_quote=True
+                    )
+                elif self.message.text != part:
+                    self.message = await self.message.edit_text(part)
+                return
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                self.retry_at = time.monotonic() + delay
+                if not wait:
+                    return
+                await asyncio.sleep(delay)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+                return
+
+
+def run_in_background(func: Callable[..., object], *args: object) -> None:
+    """Run a blocking function in a worker thread without waiting for it."""
+    task = asyncio.create_task(asyncio.to_thread(func, *args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def temp_dir_for(file_size: int) -> Optional[str]:
+    """Return TEMP_DIR if it has room to process a file of the given size.
+
+    Falls back to the system default temp directory otherwise, since tmpfs
+    mounts such as Docker's /dev/shm are often small.
+    """
+    if TEMP_DIR is None:
+        return None
+    try:
+        # Room for the download, the compressed copy and its chunks
+        if shutil.disk_usage(TEMP_DIR).free >= 3 * file_size:
+            return TEMP_DIR
+    except OSError:
+        pass
+    return None
 
-def transcribe_audio(file_path: str) -> str:
-    """Transcribe the audio file using Groq's API."""
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Return how many seconds to wait before retrying a failed Groq request.
+
+    Uses Groq's retry-after header when present, and exponential backoff
+    otherwise. Callers sleep outside groq_semaphore so waiting requests don't
+    hold a slot.
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return min(0.5 * 2**attempt, 8.0)
+
+
+async def transcribe_audio(file_name: str, audio: BinaryIO) -> str:
+    """Transcribe the audio stream using Groq's API."""
+    for attempt in range(GROQ_ATTEMPTS):
+        async with groq_semaphore:
+            try:
+                audio.seek(0)
+                return await groq_client.audio.transcriptions.create(
+                    file=(file_name, audio),
+                    model="whisper-large-v3",
+                    response_format="text",
+                    temperature=0.0,
+                )
+            except RETRYABLE_ERRORS as e:
+                if attempt == GROQ_ATTEMPTS - 1:
+                    raise
+                delay = retry_delay(attempt, e)
+        await asyncio.sleep(delay)
+
+
+async def transcribe_audio_file(file_path: str) -> str:
+    """Transcribe the audio file on disk using Groq's API."""
     with open(file_path, "rb") as file:
-        transcription = groq_client.audio.transcriptions.create(
-            file=(file_path, file.read()),
-            model="whisper-large-v3",
-            response_format="text",
-            temperature=0.0,
+        return await transcribe_audio(os.path.basename(file_path), file)
+
+
+async def run_process(*command: str, input: Optional[bytes] = None) -> Optional[bytes]:
+    """Run an external command and return its output.
+
+    Returns None if the program is not installed, exits with an error or takes
+    longer than FFMPEG_TIMEOUT.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            # Never let the program read the bot's own stdin for interactive keys
+            stdin=asyncio.subprocess.PIPE
+            if input is not None
+            else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except FileNotFoundError:
+        return None
+    try:
+        output, _ = await asyncio.wait_for(
+            process.communicate(input), FFMPEG_TIMEOUT
         )
-    return transcription
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        # Don't leave the process running after a timeout or cancellation
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    return output if process.returncode == 0 else None
+
+
+async def run_ffmpeg(*args: str, input: Optional[bytes] = None) -> Optional[bytes]:
+    """Run ffmpeg with the given arguments and return its output, or None."""
+    return await run_process("ffmpeg", "-loglevel", "error", "-y", *args, input=input)
+
+
+async def get_duration(file_path: str) -> Optional[float]:
+    """Return the length of the audio file in seconds using ffprobe."""
+    output = await run_process(
+        "ffprobe",
+        "-loglevel",
+        "error",
+        "-show_entries",
+        "format=duration",
+        "-of",
+        "default=noprint_wrappers=1:nokey=1",
+        file_path,
+    )
+    try:
+        return float(output) if output is not None else None
+    except ValueError:
+        return None
+
 
+async def compress_audio(audio: bytes) -> Optional[bytes]:
+    """Convert in-memory audio to 16kHz mono Opus, or return None on failure."""
+    return await run_ffmpeg(
+        "-i", "pipe:0", *OPUS_ARGS, "-f", "ogg", "pipe:1", input=audio
+    )
 
-def improve_transcription(transcription: str) -> str:
-    """Improve the transcription using Groq's language model."""
-    prompt = f"""
-    Task: Improve the following transcription
-    Instructions:
-    1. Fix any grammatical or spelling errors
-    2. Improve readability and coherence
-    3. Maintain the original meaning and context
-    4. Use appropriate punctuation and formatting
-    5. Only return the improved text without any additional comments
 
-    Original transcription:
-    {transcription}
+async def compress_audio_file(file_path: str, output_path: str) -> bool:
+    """Convert the audio file to 16kHz mono Opus, returning whether it succeeded."""
+    return await run_ffmpeg("-i", file_path, *OPUS_ARGS, output_path) is not None
 
-    Improved transcription:
-    """
 
-    completion = groq_client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.3,
+async def find_silences(file_path: str) -> Optional[list[float]]:
+    """Return the midpoints in seconds of the pauses in the audio file.
+
+    Returns None if ffmpeg could not analyse the file.
+    """
+    output = await run_ffmpeg(
+        "-i",
+        file_path,
+        "-vn",
+        "-af",
+        f"silencedetect=noise={SILENCE_THRESHOLD}:d={SILENCE_MIN_DURATION},"
+        "ametadata=mode=print:file=-",
+        "-f",
+        "null",
+        "-",
     )
+    if output is None:
+        return None
+
+    silences = []
+    silence_start = None
+    for line in output.decode(errors="replace").splitlines():
+        key, _, value = line.strip().partition("=")
+        if key == "lavfi.silence_start":
+            silence_start = float(value)
+        elif key == "lavfi.silence_end" and silence_start is not None:
+            silences.append((silence_start + float(value)) / 2)
+            silence_start = None
+    return silences
+
+
+def choose_cut_points(silences: list[float], duration: Optional[float]) -> list[float]:
+    """Pick cut points so that chunks are at most CHUNK_DURATION long.
+
+    Each chunk is cut at the last pause that keeps it within the limit, so
+    words are not split between chunks. Stretches longer than CHUNK_DURATION
+    without any pause, including the end of the recording, are cut at a fixed
+    interval. If the duration is unknown, the audio after the last pause is
+    left as one chunk.
+    """
+    cuts: list[float] = []
+    last_cut = 0.0
+    candidate = None
+    points = silences if duration is None else [*silences, duration]
+    for point in points:
+        if point - last_cut > CHUNK_DURATION:
+            if candidate is not None:
+                cuts.append(candidate)
+                last_cut = candidate
+            while point - last_cut > CHUNK_DURATION:
+                last_cut += CHUNK_DURATION
+                cuts.append(last_cut)
+        candidate = point if point > last_cut else None
+    return cuts
+
+
+async def split_audio(file_path: str, output_dir: str) -> list[str]:
+    """Split the audio file into chunks, preferably at pauses, using ffmpeg.
+
+    Returns the chunk paths in order, or an empty list if the file is short
+    enough to transcribe in one piece or splitting failed.
+    """
+    silences, duration = await asyncio.gather(
+        find_silences(file_path), get_duration(file_path)
+    )
+    if silences is None:
+        return []
+    cuts = choose_cut_points(silences, duration)
+    if not cuts:
+        return []
+
+    extension = os.path.splitext(file_path)[1]
+    output = await run_ffmpeg(
+        "-i",
+        file_path,
+        "-vn",
+        "-f",
+        "segment",
+        "-segment_times",
+        ",".join(f"{cut:.3f}" for cut in cuts),
+        "-c",
+        "copy",
+        os.path.join(output_dir, f"chunk%04d{extension}"),
+    )
+    if output is None:
+        return []
+    chunks = sorted(name for name in os.listdir(output_dir) if name.startswith("chunk"))
+    return [os.path.join(output_dir, name) for name in chunks]
 
-    return completion.choices[0].message.content
 
+async def transcribe_long_audio(file_path: str) -> str:
+    """Transcribe a long audio file by transcribing its chunks in parallel."""
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(file_path))
+    try:
+        # Whisper works on 16kHz mono audio, so anything more is wasted upload
+        compressed_path = os.path.join(work_dir, "compressed.ogg")
+        if await compress_audio_file(file_path, compressed_path):
+            file_path = compressed_path
+
+        chunks = await split_audio(file_path, work_dir)
+        if len(chunks) < 2:
+            return await transcribe_audio_file(file_path)
+
+        semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+
+        async def transcribe_chunk(chunk_path: str) -> str:
+            async with semaphore:
+                return await transcribe_audio_file(chunk_path)
+
+        parts = await asyncio.gather(*(transcribe_chunk(c) for c in chunks))
+    finally:
+        # Remove the compressed copy and chunks without blocking the caller
+        run_in_background(shutil.rmtree, work_dir)
 
-def generate_summary(transcription: str) -> str:
-    """Generate a summary of the transcription using Groq's language model."""
-    prompt = f"""
-    Task: Summarize the following transcription
-    Instructions:
-    1. Provide a concise summary of the main points
-    2. Use bullet points for clarity
-    3. Write from the perspective of the transcript
-    4. Capture the key ideas and any important details
-    5. Ensure the summary is coherent and easy to understand
+    return " ".join(part.strip() for part in parts if part.strip())
 
-    Transcription:
-    {transcription}
 
-    Summary:
+async def stream_transcription(
+    transcription: str, summarize: bool = True
+) -> AsyncIterator[str]:
+    """Improve and summarize the transcription, yielding text as it is generated.
+
+    The improved transcription comes first, followed by SUMMARY_SEPARATOR and
+    the summary. Without summarize, only the improved transcription is returned.
     """
+    system_prompt = SYSTEM_PROMPT if summarize else IMPROVE_SYSTEM_PROMPT
+    deltas: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+    async def produce() -> None:
+        # Only this task holds groq_semaphore, so a slow consumer (e.g. one
+        # waiting out Telegram's flood control) doesn't keep a Groq slot busy
+        try:
+            for attempt in range(GROQ_ATTEMPTS):
+                async with groq_semaphore:
+                    try:
+                        stream = await groq_client.chat.completions.create(
+                            model="llama-3.1-70b-versatile",
+                            messages=[
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": transcription},
+                            ],
+                            temperature=0.3,
+                            stream=True,
+                        )
+                    except RETRYABLE_ERRORS as e:
+                        if attempt == GROQ_ATTEMPTS - 1:
+                            raise
+                        delay = retry_delay(attempt, e)
+                    else:
+                        async for chunk in stream:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                deltas.put_nowait(chunk.choices[0].delta.content)
+                        return
+                await asyncio.sleep(delay)
+        finally:
+            deltas.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (delta := await deltas.get()) is not None:
+            yield delta
+        # Re-raise any error from the producer
+        await producer
+    finally:
+        producer.cancel()
 
-    completion = groq_client.chat.completions.create(
-        model="llama-3.1-70b-versatile",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.3,
-    )
 
-    return completion.choices[0].message.content
+async def stream_results(
+    update: Update, original_transcription: str, summarize: bool
+) -> tuple[str, str]:
+    """Stream the improved transcription and summary to the user as generated.
+
+    Returns the improved transcription and the summary, which is empty
+    without summarize.
+    """
+    improved_reply = StreamingReply(update)
+    summary_reply = StreamingReply(update)
+    content = ""
+    summary_start = -1
+    async for delta in stream_transcription(original_transcription, summarize):
+        content += delta
+        if not summarize:
+            await improved_reply.set_text(content)
+            continue
+        if summary_start == -1:
+            # Only the newly added text can complete the separator
+            search_start = len(content) - len(delta) - len(SUMMARY_SEPARATOR)
+            index = content.find(SUMMARY_SEPARATOR, max(0, search_start))
+            if index == -1:
+                # Hold back a trailing partial separator until it is complete
+                improved = content
+                for size in range(len(SUMMARY_SEPARATOR) - 1, 0, -1):
+                    if improved.endswith(SUMMARY_SEPARATOR[:size]):
+                        improved = improved[:-size]
+                        break
+                await improved_reply.set_text(improved)
+                continue
+            summary_start = index + len(SUMMARY_SEPARATOR)
+            improved_reply.text = content[:index]
+            await improved_reply.flush(final=True)
+        await summary_reply.set_text(content[summary_start:])
+
+    if summary_start == -1:
+        # No separator arrived, so any held back text belongs to the reply
+        improved_reply.text = content
+    await improved_reply.flush(final=True)
+    await summary_reply.flush(final=True)
+    return improved_reply.text.strip(), summary_reply.text.strip()
+
+
+async def send_results(update: Update, original_transcription: str) -> None:
+    """Improve and summarize the transcription and send both to the user.
+
+    Results are cached, and concurrent requests for the same transcription
+    wait for the one already being generated instead of starting another.
+    """
+    # Short voice notes are usually transcribed cleanly and need no summary
+    word_count = len(original_transcription.split())
+    if word_count == 0:
+        await update.message.reply_text("No speech detected.", do_quote=True)
+        return
+    if word_count < MIN_IMPROVE_WORDS:
+        for part in split_message(original_transcription.strip()):
+            await update.message.reply_text(part, do_quote=True)
+        return
+
+    result_key = hashlib.sha256(original_transcription.encode()).hexdigest()
+    result = cache_get(result_cache, result_key)
+    if result is None:
+        pending = inflight_results.get(result_key)
+        if pending is None:
+            pending = asyncio.get_running_loop().create_future()
+            # Mark failures as retrieved even if nobody else is waiting
+            pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+            inflight_results[result_key] = pending
+            try:
+                result = await stream_results(
+                    update,
+                    original_transcription,
+                    summarize=word_count >= MIN_SUMMARY_WORDS,
+                )
+                cache_put(result_cache, result_key, result)
+                pending.set_result(result)
+                return
+            except asyncio.CancelledError:
+                pending.cancel()
+                raise
+            except Exception as e:
+                pending.set_exception(e)
+                raise
+            finally:
+                del inflight_results[result_key]
+
+        # Shield the shared result so this caller being cancelled doesn't
+        # cancel it for the one generating it
+        result = await asyncio.shield(pending)
+
+    for text in result:
+        for part in split_message(text):
+            await update.message.reply_text(part, do_quote=True)
+
+
+async def download_and_transcribe(file: File, file_extension: str) -> str:
+    """Download the Telegram file and transcribe it."""
+    # Small files (most voice notes) are kept in memory; larger ones go to
+    # disk to avoid holding many big uploads in RAM at once.
+    if file.file_size < IN_MEMORY_MAX_SIZE:
+        audio = io.BytesIO()
+        await file.download_to_memory(audio)
+        file_name = f"audio{file_extension}"
+        if file.file_size > COMPRESS_MIN_SIZE:
+            compressed = await compress_audio(audio.getvalue())
+            if compressed is not None:
+                audio = io.BytesIO(compressed)
+                file_name = "audio.ogg"
+        audio.seek(0)
+        return await transcribe_audio(file_name, audio)
+
+    with tempfile.NamedTemporaryFile(
+        suffix=file_extension, delete=False, dir=temp_dir_for(file.file_size)
+    ) as temp_file:
+        temp_file_path = temp_file.name
+    try:
+        await file.download_to_drive(custom_path=temp_file_path)
+        return await transcribe_long_audio(temp_file_path)
+    finally:
+        # Delete the temp file in the background so the caller can continue
+        run_in_background(os.unlink, temp_file_path)
+
+
+async def get_transcription(file: File, file_extension: str) -> str:
+    """Return the transcription of the Telegram file.
+
+    Results are cached, and concurrent requests for the same audio (e.g. a
+    voice message forwarded to several chats) share a single transcription.
+    """
+    file_id = file.file_unique_id
+    transcription = cache_get(transcription_cache, file_id)
+    if transcription is not None:
+        return transcription
+
+    task = inflight_transcriptions.get(file_id)
+    if task is None:
+
+        async def transcribe() -> str:
+            try:
+                transcription = await download_and_transcribe(file, file_extension)
+                cache_put(transcription_cache, file_id, transcription)
+                return transcription
+            finally:
+                del inflight_transcriptions[file_id]
+
+        task = asyncio.create_task(transcribe())
+        inflight_transcriptions[file_id] = task
+
+    # Shield the shared task so one caller being cancelled doesn't cancel it
+    # for the others
+    return await asyncio.shield(task)
 
 
 async def process_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Process the incoming audio file or voice message."""
-    file: Union[None, "telegram.File"] = None
+    file: Optional[File] = None
     file_extension = ""
 
     if update.message.voice:
@@ -124,30 +710,21 @@ async def process_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         )
         return
 
-    with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_file:
-        await file.download_to_drive(custom_path=temp_file.name)
-        temp_file_path = temp_file.name
-
     try:
         await update.message.reply_text(
             "Processing your audio. This may take a moment..."
         )
 
-        original_transcription = transcribe_audio(temp_file_path)
-        improved_transcription = improve_transcription(original_transcription)
-
-        for part in split_message(improved_transcription):
-            await update.message.reply_text(part, do_quote=True)
-
-        summary = generate_summary(improved_transcription)
-        for part in split_message(summary):
-            await update.message.reply_text(part, do_quote=True)
+        original_transcription = await get_transcription(file, file_extension)
+        await send_results(update, original_transcription)
 
     except Exception as e:
         await update.message.reply_text(f"An error occurred: {str(e)}")
 
-    finally:
-        os.unlink(temp_file_path)
+
+async def close_groq_client(application: Application) -> None:
+    """Close the Groq client's connection pool when the bot shuts down."""
+    await groq_client.close()
 
 
 def main() -> None:
@@ -157,14 +734,32 @@ def main() -> None:
     if not os.getenv("GROQ_API_KEY"):
         raise ValueError("GROQ_API_KEY is not set in the .env file")
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Use the faster libuv-based event loop where it is available. run_polling
+    # picks up the current event loop, so setting it here is enough.
+    if sys.platform != "win32":
+        import uvloop
+
+        asyncio.set_event_loop(uvloop.new_event_loop())
+
+    # Handle updates concurrently so one user's audio doesn't hold up others
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_shutdown(close_groq_client)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(
         MessageHandler(filters.VOICE | filters.AUDIO, process_audio)
     )
 
-    application.run_polling()
+    # Long-poll for up to 30s per request and only fetch message updates, the
+    # only kind the bot handles
+    application.run_polling(
+        poll_interval=0.0, timeout=30, allowed_updates=[Update.MESSAGE]
+    )
 
 
 if __name__ == "__main__":